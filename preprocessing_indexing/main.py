@@ -4,220 +4,324 @@ import re
 import traceback
 import time
 import math
+import os
+import string
+import itertools
+import queue
+import hashlib
 from var import SYNONYMS, STOP_WORDS
 from collections import defaultdict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+from botocore.config import Config
+import botocore.serialize
 
-kendra = boto3.client( 'kendra', region_name='ap-southeast-2')
 
+class _OrjsonSerializer:
+    """Drop-in for the json module inside botocore.serialize, backed by orjson."""
 
-def update_index_metadata(index_id):
-    """
-    Updates the specified Kendra index with the given metadata configurations.
+    def __init__(self, orjson_module):
+        self._orjson = orjson_module
 
-    Args:
-        index_id (str): The unique identifier of the Kendra index to update.
+    def dumps(self, obj, **kwargs):
+        # Calls with stdlib-specific options (separators, cls, ...) keep using json
+        if kwargs:
+            return json.dumps(obj, **kwargs)
+        return self._orjson.dumps(obj).decode('utf-8')
 
-    Returns:
-        The response from the Kendra service after updating the index metadata.
+    def __getattr__(self, name):
+        return getattr(json, name)
 
-    Raises:
-        Exception: If there is an error updating the index metadata.
+
+def enable_orjson_serializer():
     """
+    Serializes boto3 JSON request bodies (e.g. batch_put_document payloads) with orjson.
 
-    default_fields = [
-        {
-            "Name": "_last_updated_at",     # get fresh items
-            "Type": "DATE_VALUE",
-            "Relevance": {
-                "Freshness": True,
-                "Importance": 10
+    Returns:
+        bool: True if orjson is installed and the serializer was swapped, False otherwise.
+    """
+    try:
+        import orjson
+    except ImportError:
+        print("orjson is not installed, keeping the default botocore JSON serializer")
+        return False
+    botocore.serialize.json = _OrjsonSerializer(orjson)
+    return True
+
+
+# Opt-in: only patch botocore when explicitly requested
+if os.environ.get('KENDRA_USE_ORJSON', '').lower() in ('1', 'true', 'yes'):
+    enable_orjson_serializer()
+
+# Adaptive retries back off on ThrottlingException when batches upload concurrently
+kendra = boto3.client(
+    'kendra',
+    region_name='ap-southeast-2',
+    config=Config(retries={'mode': 'adaptive', 'max_attempts': 10})
+)
+
+# Number of batch_put_document calls kept in flight during ingestion
+UPLOAD_WORKERS = 16
+# Maximum number of normalized batches waiting to be uploaded
+UPLOAD_QUEUE_SIZE = 1000
+# Worker processes and items per task for the CPU-bound normalize_item pass
+PREPROCESS_WORKERS = os.cpu_count()
+PREPROCESS_CHUNKSIZE = 256
+
+_MALE_TERMS = frozenset({'male', 'men', 'boys', 'mens', 'boy'})
+_FEMALE_TERMS = frozenset({'female', 'women', 'ladies', 'girls', 'womens', 'ladie', 'girl'})
+# Punctuation (except '_', a word character) splits words like a regex word boundary
+_WORD_SEPARATORS = str.maketrans({char: ' ' for char in string.punctuation if char != '_'})
+
+# Regex patterns are compiled once at import time instead of on every call
+# Characters removed by cleanup; the rest of the word is kept together ("h&m" -> "hm")
+_CLEAN_RE = re.compile(r'[^a-zA-Z0-9\s,-]')
+# Characters stripped from price/discount strings (the decimal point '.' is kept)
+_NUMBER_UNWANTED_TABLE = str.maketrans('', '', "$% ")
+
+
+def _build_synonym_map(synonym_dict):
+    # Map every synonym to its canonical term(s); a synonym listed under several
+    # terms (e.g. "pants") expands to all of them
+    terms_by_synonym = defaultdict(list)
+    for term, synonyms in synonym_dict.items():
+        for synonym in synonyms:
+            if term not in terms_by_synonym[synonym.lower()]:
+                terms_by_synonym[synonym.lower()].append(term)
+    return {synonym: ", ".join(terms) for synonym, terms in terms_by_synonym.items()}
+
+
+_SYN_MAP = _build_synonym_map(SYNONYMS)
+# Text is lowercased before filtering, so stop words are compared lowercased too
+_STOP_SET = frozenset(word.lower() for word in STOP_WORDS)
+
+# Single alternation over all synonyms, longest first so multi-word synonyms win.
+# google-re2 matches large alternations in linear time; fall back to re without it.
+# RE2's \b is ASCII-only, so the re fallback is compiled with re.ASCII to index the
+# same text whichever engine is installed (both match "jeans" inside "jeansé").
+# No case-insensitive flag: preprocess_text lowercases the text before matching
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+
+def _synonym_alternation(escape):
+    return r'\b(' + '|'.join(escape(s) for s in sorted(_SYN_MAP, key=len, reverse=True)) + r')\b'
+
+
+if re2 is not None:
+    _SYN_RE = re2.compile(_synonym_alternation(re2.escape))
+else:
+    _SYN_RE = re.compile(_synonym_alternation(re.escape), re.ASCII)
+
+# Index fields (attributes) configured on the Kendra index before ingestion
+_DEFAULT_METADATA_FIELDS = [
+    {
+        "Name": "_last_updated_at",     # get fresh items
+        "Type": "DATE_VALUE",
+        "Relevance": {
+            "Freshness": True,
+            "Importance": 10
+        }
+    },
+    {
+        'Name': 'gender',
+        'Type': 'STRING_VALUE',
+        'Relevance': {
+            'Importance': 10,
+            # 'Duration': 'string',
+            # 'RankOrder': 'ASCENDING'|'DESCENDING',
+            'ValueImportanceMap': {
+                'male': 10,
+                'female':10,
+                'male female':8
             }
         },
-        {
-            'Name': 'gender',
-            'Type': 'STRING_VALUE',
-            'Relevance': {
-                'Importance': 10,
-                # 'Duration': 'string',
-                # 'RankOrder': 'ASCENDING'|'DESCENDING',
-                'ValueImportanceMap': {
-                    'male': 10,
-                    'female':10,
-                    'male female':8
-                }
-            },
-            'Search': {
-                'Facetable': True,
-                'Searchable': True,
-                'Displayable': True,
-                'Sortable': True
-            }
+        'Search': {
+            'Facetable': True,
+            'Searchable': True,
+            'Displayable': True,
+            'Sortable': True
+        }
+    },
+    
+    {
+        'Name': 'product_type',    # important
+        'Type': 'STRING_LIST_VALUE',
+        # 'Relevance': {
+        #     'Importance': 9,
+        #     # 'Duration': 'string',
+        #     # 'RankOrder': 'ASCENDING'|'DESCENDING',
+        # },
+        'Search': {
+            'Facetable': True,
+            'Searchable': True,
+            'Displayable': True,
+            'Sortable': False
+        }
+    },
+
+
+    {
+        'Name': 'occasion',    # important
+        'Type': 'STRING_LIST_VALUE',
+        # 'Relevance': {
+        #     'Importance': 9,
+        #     # 'Duration': 'string',
+        #     # 'RankOrder': 'ASCENDING'|'DESCENDING',
+        # },
+        'Search': {
+            'Facetable': True,
+            'Searchable': True,
+            'Displayable': True,
+            'Sortable': False
+        }
+    },
+    {
+        'Name': 'brand',    # important
+        'Type': 'STRING_VALUE',
+        # 'Relevance': {
+        #     'Importance': 5,
+        #     # 'Duration': 'string',
+        #     # 'RankOrder': 'ASCENDING'|'DESCENDING',
+        # },
+        'Search': {
+            'Facetable': True,
+            'Searchable': True,
+            'Displayable': True,
+            'Sortable': True
+        }
+    },
+    {
+        'Name': 'product_id',    # important
+        'Type': 'STRING_VALUE',
+        'Search': {
+            'Facetable': False,
+            'Searchable': False,
+            'Displayable': True,
+            'Sortable': True
+        }
+    },
+    {
+        'Name': 'category',    # important
+        'Type': 'STRING_VALUE',
+        #  'Relevance': {
+        #     'Importance': 8,
+        #     # 'Duration': 'string',
+        #     # 'RankOrder': 'ASCENDING'|'DESCENDING',
+        # },
+        'Search': {
+            'Facetable': True,
+            'Searchable': True,
+            'Displayable': True,
+            'Sortable': False
+        }
+    },
+    {
+        'Name': 'color',    # good to have
+        'Type': 'STRING_LIST_VALUE',
+        # 'Relevance': {
+        #     'Importance': 8,
+        #     # 'Duration': 'string',
+        #     # 'RankOrder': 'ASCENDING'|'DESCENDING',
+        # },
+        'Search': {
+            'Facetable': True,
+            'Searchable': True,
+            'Displayable': True,
+            'Sortable': False
+        }
+    },
+
+
+    # Long values / Numerics
+    {
+        'Name': 'rating',
+        'Type': 'LONG_VALUE',
+        'Search': {
+            'Facetable': True,
+            'Searchable': False,
+            'Displayable': True,
+            'Sortable': True
         },
-        
-        {
-            'Name': 'product_type',    # important
-            'Type': 'STRING_LIST_VALUE',
-            # 'Relevance': {
-            #     'Importance': 9,
-            #     # 'Duration': 'string',
-            #     # 'RankOrder': 'ASCENDING'|'DESCENDING',
-            # },
-            'Search': {
-                'Facetable': True,
-                'Searchable': True,
-                'Displayable': True,
-                'Sortable': False
-            }
+        # 'Relevance': {
+        #     # 'Freshness': True|False,
+        #     'Importance': 8,
+        #     # 'Duration': 'string',
+        #     'RankOrder': 'ASCENDING',
+        # }
+    },
+    {
+        'Name': 'final_price',
+        'Type': 'LONG_VALUE',
+        'Search': {
+            'Facetable': True,
+            'Searchable': False,
+            'Displayable': True,
+            'Sortable': True
         },
+        # 'Relevance': {
+        #     # 'Freshness': True|False,
+        #     'Importance': 7,
+        #     # 'Duration': 'string',
+        #     'RankOrder': 'DESCENDING',
+        # }
+    },
+    {
+        'Name': 'discount',
+        'Type': 'LONG_VALUE',
+        'Search': {
+            'Facetable': True,
+            'Searchable': False,
+            'Displayable': True,
+            'Sortable': True
+        },
+        # 'Relevance': {
+        #     # 'Freshness': True|False,
+        #     'Importance': 6,
+        #     # 'Duration': 'string',
+        #     'RankOrder': 'ASCENDING',
+        # }
+    }
+]
 
 
-        {
-            'Name': 'occasion',    # important
-            'Type': 'STRING_LIST_VALUE',
-            # 'Relevance': {
-            #     'Importance': 9,
-            #     # 'Duration': 'string',
-            #     # 'RankOrder': 'ASCENDING'|'DESCENDING',
-            # },
-            'Search': {
-                'Facetable': True,
-                'Searchable': True,
-                'Displayable': True,
-                'Sortable': False
-            }
-        },
-        {
-            'Name': 'brand',    # important
-            'Type': 'STRING_VALUE',
-            # 'Relevance': {
-            #     'Importance': 5,
-            #     # 'Duration': 'string',
-            #     # 'RankOrder': 'ASCENDING'|'DESCENDING',
-            # },
-            'Search': {
-                'Facetable': True,
-                'Searchable': True,
-                'Displayable': True,
-                'Sortable': True
-            }
-        },
-        {
-            'Name': 'product_id',    # important
-            'Type': 'STRING_VALUE',
-            'Search': {
-                'Facetable': False,
-                'Searchable': False,
-                'Displayable': True,
-                'Sortable': True
-            }
-        },
-        {
-            'Name': 'category',    # important
-            'Type': 'STRING_VALUE',
-            #  'Relevance': {
-            #     'Importance': 8,
-            #     # 'Duration': 'string',
-            #     # 'RankOrder': 'ASCENDING'|'DESCENDING',
-            # },
-            'Search': {
-                'Facetable': True,
-                'Searchable': True,
-                'Displayable': True,
-                'Sortable': False
-            }
-        },
-        {
-            'Name': 'color',    # good to have
-            'Type': 'STRING_LIST_VALUE',
-            # 'Relevance': {
-            #     'Importance': 8,
-            #     # 'Duration': 'string',
-            #     # 'RankOrder': 'ASCENDING'|'DESCENDING',
-            # },
-            'Search': {
-                'Facetable': True,
-                'Searchable': True,
-                'Displayable': True,
-                'Sortable': False
-            }
-        },
+def update_index_metadata(index_id):
+    """
+    Updates the specified Kendra index with the given metadata configurations.
 
+    Args:
+        index_id (str): The unique identifier of the Kendra index to update.
 
-        # Long values / Numerics
-        {
-            'Name': 'rating',
-            'Type': 'LONG_VALUE',
-            'Search': {
-                'Facetable': True,
-                'Searchable': False,
-                'Displayable': True,
-                'Sortable': True
-            },
-            # 'Relevance': {
-            #     # 'Freshness': True|False,
-            #     'Importance': 8,
-            #     # 'Duration': 'string',
-            #     'RankOrder': 'ASCENDING',
-            # }
-        },
-        {
-            'Name': 'final_price',
-            'Type': 'LONG_VALUE',
-            'Search': {
-                'Facetable': True,
-                'Searchable': False,
-                'Displayable': True,
-                'Sortable': True
-            },
-            # 'Relevance': {
-            #     # 'Freshness': True|False,
-            #     'Importance': 7,
-            #     # 'Duration': 'string',
-            #     'RankOrder': 'DESCENDING',
-            # }
-        },
-        {
-            'Name': 'discount',
-            'Type': 'LONG_VALUE',
-            'Search': {
-                'Facetable': True,
-                'Searchable': False,
-                'Displayable': True,
-                'Sortable': True
-            },
-            # 'Relevance': {
-            #     # 'Freshness': True|False,
-            #     'Importance': 6,
-            #     # 'Duration': 'string',
-            #     'RankOrder': 'ASCENDING',
-            # }
-        }
-    ]
+    Returns:
+        The response from the Kendra service after updating the index metadata.
+
+    Raises:
+        Exception: If there is an error updating the index metadata.
+    """
 
     # Update the Kendra index with the specified metadata configurations
     try:
         response = kendra.update_index(
             Id=index_id,
-            DocumentMetadataConfigurationUpdates=default_fields
+            DocumentMetadataConfigurationUpdates=_DEFAULT_METADATA_FIELDS
         )
         #print("Index metadata updated successfully.", response)
+        return response
     except Exception as e:
         print("Error updating index metadata:", str(e))
 
 
 
+@lru_cache(maxsize=65536)
 def change_gender(txt):
-    txt = txt.lower()  # Convert text to lowercase for case-insensitive matching
+    # Lowercase and tokenize for case-insensitive whole-word matching
+    words = set(txt.lower().translate(_WORD_SEPARATORS).split())
     # print("Gender text::" , txt)
-    male_terms = ['male', 'men', 'boys', 'mens', 'boy',]
-    female_terms = ['female', 'women', 'ladies', 'girls', 'womens', 'ladie', 'girl']
-
-    # Create regex patterns for whole-word matching
-    male_pattern = r'\b(?:' + '|'.join(male_terms) + r')\b'
-    female_pattern = r'\b(?:' + '|'.join(female_terms) + r')\b'
-
-    has_male = bool(re.search(male_pattern, txt))
-    has_female = bool(re.search(female_pattern, txt))
+    has_male = not _MALE_TERMS.isdisjoint(words)
+    has_female = not _FEMALE_TERMS.isdisjoint(words)
 
     if has_male and has_female:
         return 'male female'
@@ -228,30 +332,19 @@ def change_gender(txt):
     return 'unknown'  # Return 'unknown' if no match
 
 def remove_redundant_words(text):
-    # Tokenize the text into phrases (assuming phrases are separated by commas)
-    phrases = [phrase.strip() for phrase in text.split(',')]
-
-    # Extract the main words from each phrase (e.g., "formal wear" -> ["formal", "wear"])
-    phrase_components = [phrase.split() for phrase in phrases]
-
-    # Group phrases by their last word (e.g., "wear")
+    # Group phrases (separated by commas) by their last word in a single pass,
+    # e.g. "formal wear" -> modifier "formal", ending word "wear"
     grouped_phrases = defaultdict(list)
-    for components in phrase_components:
-        if components:
-            grouped_phrases[components[-1]].append(' '.join(components[:-1]))
-
-    # Reconstruct phrases intelligently
-    processed_phrases = []
-    for ending_word, modifiers in grouped_phrases.items():
-        if modifiers:
-            # Combine modifiers and append the shared ending word
-            combined_modifiers = ', '.join(sorted(modifiers))
-            processed_phrases.append(f"{combined_modifiers} {ending_word}")
-        else:
-            processed_phrases.append(ending_word)
+    for phrase in text.split(','):
+        modifier, _, ending_word = phrase.strip().rpartition(' ')
+        if ending_word:
+            grouped_phrases[ending_word].append(modifier)
 
-    # Join the processed phrases into a final text
-    return ', '.join(processed_phrases)
+    # Reconstruct phrases intelligently: combine modifiers and append the shared ending word
+    return ', '.join(
+        f"{', '.join(sorted(modifiers))} {ending_word}" if modifiers else ending_word
+        for ending_word, modifiers in grouped_phrases.items()
+    )
 
 
 # def preprocess_text(text):
@@ -268,22 +361,19 @@ def remove_redundant_words(text):
 #     return " ".join(word for word in words if word not in STOP_WORDS) or " "
 
 
+@lru_cache(maxsize=65536)
 def preprocess_text(text):
     if not isinstance(text, str):
         return text
 
     text = text.lower()
 
-    for term, synonyms in SYNONYMS.items():
-        for synonym in synonyms:
-            pattern = rf"\b{synonym}\b"
-            text = re.sub(pattern, rf"{synonym}, {term}", text, flags=re.IGNORECASE)  # Keep both original and mapped word
+    # Keep both original and mapped word, in a single pass over the (already lowercased) text
+    text = _SYN_RE.sub(lambda m: f"{m.group(0)}, {_SYN_MAP[m.group(0)]}", text)
 
     # text = re.sub(r'[^a-zA-Z0-9\s-]', '', text)
-    text = re.sub(r'[^a-zA-Z0-9\s,-]', '', text)
-
-    words = text.split()
-    processed_text = " ".join(word for word in words if word not in STOP_WORDS) or " "
+    words = _CLEAN_RE.sub('', text).split()
+    processed_text = " ".join(word for word in words if word not in _STOP_SET) or " "
 
     return processed_text
 
@@ -291,19 +381,19 @@ def preprocess_text(text):
 def get_list(input_string):
     return [word.strip() for word in input_string.split(",") if word.strip()]
 
-def clean_and_convert_to_number(input_string):
+@lru_cache(maxsize=65536)
+def clean_and_convert_to_number(input_string, default=None):
+    # Missing or empty values return default instead of raising
+    if input_string is None:
+        return default
     if not isinstance(input_string, str):
         return math.ceil(input_string)
-            
-    # Define the characters to remove (excluding the decimal point '.')
-    unwanted_chars = "$% "
-    
+
     # Remove unwanted characters
-    cleaned_string = ''.join(char for char in input_string if char not in unwanted_chars)
-    
-    # Convert to a float if it contains a decimal, otherwise to an int
-    # if '.' in cleaned_string:
-    # return float(cleaned_string)
+    cleaned_string = input_string.translate(_NUMBER_UNWANTED_TABLE)
+    if not cleaned_string:
+        return default
+
     float_val = float(cleaned_string)
     return int(math.ceil(float_val))
 
@@ -341,24 +431,24 @@ def add_thesaurus_to_kendra(index_id, s3_path, role_arn, thesaurus_name, descrip
         raise
 
 
+# Item fields that hold numbers and are passed through without text preprocessing
+_NUMERIC_KEYS = frozenset({'discount', 'rating', 'final_price'})
+
+
 def normalize_item(item):
     def preprocess_optional_field(key, default=" "):
         # Safely preprocess text with a default value if key is missing
         # return preprocess_text(item.get(key, {}).get('S', default))
-        if key in ['discount' , 'rating' , 'final_price']:
-            if item.get(key, {}).get('S', None):
-                return item.get(key, {}).get('S', None)
-            elif item.get(key, {}).get('N', None):
-                return  item.get(key, {}).get('N', None)
-            else:
-                return default
-        else:
-            if item.get(key, {}).get('S', None):
-                return preprocess_text(item.get(key, {}).get('S', None))
-            elif item.get(key, {}).get('N', None):
-                return  preprocess_text(item.get(key, {}).get('N', None))
-            else:
-                return  default
+        value = item.get(key)
+        if not value:
+            return default
+        if key in _NUMERIC_KEYS:
+            return value.get('S') or value.get('N') or default
+        # Only string values go through text preprocessing; numbers are passed through
+        text = value.get('S')
+        if text:
+            return preprocess_text(text)
+        return value.get('N') or default
     
     # Attributes
     # Extract and preprocess key fields
@@ -370,20 +460,26 @@ def normalize_item(item):
     color = remove_redundant_words(preprocess_optional_field('color', default="Unknown"))
     occasion = remove_redundant_words(preprocess_optional_field('occasion', default="Any Occasion"))
 
-    discount = preprocess_optional_field('discount' , default=0)
-    rating = preprocess_optional_field('rating' , default=0)
-    final_price =  preprocess_optional_field('final_price' , default=0)
+    discount = preprocess_optional_field('discount' , default=None)
+    rating = preprocess_optional_field('rating' , default=None)
+    final_price =  preprocess_optional_field('final_price' , default=None)
     description = preprocess_optional_field('description', default="Unknown")
     
-    rating_int = int(float(rating)*10) or 1
-    discount_int = clean_and_convert_to_number(discount)  or 0
-    final_price_int = clean_and_convert_to_number(final_price) or 100
+    # Defaults apply only to missing values, so a real 0 rating/price is kept
+    rating_int = int(float(rating)*10) if rating is not None else 1
+    discount_int = clean_and_convert_to_number(discount, default=0)
+    final_price_int = clean_and_convert_to_number(final_price, default=100)
     
     # return (
     #     color, product_type, occasion, item.get('product_id', {}).get('S', "")
     # )
     
-    kendra_product_chunk_list = get_chunks_for_product(get_list(color), get_list(product_type), get_list(occasion))
+    # Split the list fields once; they feed both the chunks and the list attributes
+    product_type_list = get_list(product_type)
+    color_list = get_list(color)
+    occasion_list = get_list(occasion)
+
+    kendra_product_chunk_list = get_chunks_for_product(color_list, product_type_list, occasion_list)
     
     normalized_items = []
     
@@ -421,19 +517,19 @@ def normalize_item(item):
             {
                 "Key": "product_type",
                 "Value": {
-                    "StringListValue": get_list(product_type)[:10]
+                    "StringListValue": product_type_list[:10]
                 }
             },
             {
                 "Key": "color",
                 "Value": {
-                    "StringListValue": get_list(color)[:10]
+                    "StringListValue": color_list[:10]
                 }
             },
             {
                 "Key": "occasion",
                 "Value": {
-                    "StringListValue": get_list(occasion)[:10]
+                    "StringListValue": occasion_list[:10]
                 }
             },
             
@@ -472,25 +568,21 @@ def get_chunks_for_product(color, product_type, occasion):
     
 
 def doc_chunks(list1, list2):
-    # Determine a dynamic window size based on list lengths
-    min_length = min(len(list1), len(list2))
-    
-    if min_length == 0:  # Handle empty lists
+    # The window size is the length of the shorter list, so the shorter list is
+    # always used whole and only the longer one is slid over
+    window_size = min(len(list1), len(list2))
+
+    if window_size == 0:  # Handle empty lists
         return []
 
-    # # Use a fraction of the min length (e.g., 1/3) but at least 1
-    # print("lengths::", len(list1), len(list2))
-    window_size = min_length
-    # window_size = max(1, min(4, min_length // 2))
-    # print("window_size::", window_size)
-    cross_product_list = []
-    for i in range(0, max(1, len(list1) - window_size + 1)):
-        for j in range(0, max(1, len(list2) - window_size + 1)):
-            l1 = list1[i:i + window_size] if i + window_size <= len(list1) else list1[i:]
-            l2 = list2[j:j + window_size] if j + window_size <= len(list2) else list2[j:]
-            cross_product_list.append(" ".join(l1) + " " + " ".join(l2))
-    
-    return cross_product_list
+    if len(list1) <= len(list2):
+        head = " ".join(list1)
+        return [head + " " + " ".join(list2[j:j + window_size])
+                for j in range(len(list2) - window_size + 1)]
+
+    tail = " ".join(list2)
+    return [" ".join(list1[i:i + window_size]) + " " + tail
+            for i in range(len(list1) - window_size + 1)]
 
 s3_uri = ""
 role_arn = ""
@@ -499,6 +591,48 @@ description = "A thesaurus file for custom synonyms of product types and colors.
 
 
 
+def get_document_key(document):
+    """
+    Returns a compact key identifying a whole document.
+
+    Id, Title, Blob and Attributes are all part of the key, so only truly identical
+    documents are skipped: an updated price for the same product is still uploaded,
+    and distinct products with identical text keep their own Ids.
+    """
+    content = json.dumps(
+        [document["Id"], document["Title"], document["Blob"], document["Attributes"]],
+        sort_keys=True
+    )
+    return hashlib.blake2b(content.encode(), digest_size=16).digest()
+
+
+def upload_batches(batch_queue, index_id, errors):
+    """
+    Uploads document batches from the queue to Kendra until a None sentinel is received.
+
+    Upload errors are printed and collected in errors instead of stopping the
+    consumer, so the queue keeps draining and the producer never blocks on it.
+    """
+    while True:
+        task = batch_queue.get()
+        if task is None:
+            return
+        batch_number, batch = task
+        try:
+            response = kendra.batch_put_document(IndexId=index_id, Documents=batch)
+        except Exception as e:
+            print(f"Batch {batch_number}: Upload failed:", str(e))
+            errors.append(e)
+            continue
+
+        # Check response for successful or failed uploads
+        successful = response.get('FailedDocuments', [])
+        if successful:
+            print(f"Batch {batch_number}: Some documents failed to upload. Details: {successful}")
+        else:
+            print(f"Batch {batch_number}: All documents uploaded successfully.")
+
+
 def main(items, index_id):
     try:
         #print("Initial items (first 2):", items[:2])
@@ -512,29 +646,45 @@ def main(items, index_id):
         except Exception as e:
             print("Failed adding theasaurus file to kendra" , e)
         
+        # Pipeline the stages: batches are uploaded while later items are still
+        # being normalized, instead of normalizing everything up front
+        batch_size = 10
+        batch_queue = queue.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+        upload_errors = []
         documents = []
-        for item in items:
-            normalized_item = normalize_item(item)
-            # print("normalized_item::len::" , len(normalized_item))
-            documents.extend(normalized_item)
-        
+        # normalize_item is pure CPU work per item, so spread it across processes.
+        # The pool is created before any upload thread starts, so its workers are
+        # never forked from a multi-threaded process
+        with Pool(processes=PREPROCESS_WORKERS) as pool:
+            with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+                for _ in range(UPLOAD_WORKERS):
+                    executor.submit(upload_batches, batch_queue, index_id, upload_errors)
+                try:
+                    normalized_items = pool.imap(normalize_item, items, chunksize=PREPROCESS_CHUNKSIZE)
+                    batch = []
+                    seen_documents = set()
+                    for document in itertools.chain.from_iterable(normalized_items):
+                        # Skip documents identical to one already queued in this run
+                        document_key = get_document_key(document)
+                        if document_key in seen_documents:
+                            continue
+                        seen_documents.add(document_key)
+                        documents.append(document)
+                        batch.append(document)
+                        if len(batch) == batch_size:
+                            batch_queue.put((len(documents) // batch_size, batch))
+                            batch = []
+                    if batch:
+                        batch_queue.put((len(documents) // batch_size + 1, batch))
+                finally:
+                    # One sentinel per consumer so every upload thread exits
+                    for _ in range(UPLOAD_WORKERS):
+                        batch_queue.put(None)
+
         print("Normalized documents (first 2):", documents[:2])
-        
-        
-#         # Process documents in batches of 10
-        batch_size = 10
         print("document size::" , len(documents))
-        for i in range(0, len(documents), batch_size):
-            batch = documents[i:i+batch_size]
-            # print(batch)
-            response = kendra.batch_put_document(IndexId=index_id, Documents=batch)
-
-            # Check response for successful or failed uploads
-            successful = response.get('FailedDocuments', [])
-            if successful:
-                print(f"Batch {i//10 + 1}: Some documents failed to upload. Details: {successful}")
-            else:
-                print(f"Batch {i//10 + 1}: All documents uploaded successfully.")
+        if upload_errors:
+            raise upload_errors[0]
 
         # return {"status": "completed"}
         print("length of documents::", len(documents))
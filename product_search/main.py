@@ -5,14 +5,31 @@ Provides functionality for index management and product retrieval.
 
 import boto3
 import time
+import logging
+import threading
+import numpy as np
 from logging_config import logger
 from collections import defaultdict
-from rapidfuzz.fuzz import ratio, token_set_ratio, partial_ratio
-from rapidfuzz.process import extract
-from typing import List, Dict
-
-# Initialize Kendra client
-kendra = boto3.client('kendra', region_name='ap-southeast-2')
+from operator import itemgetter
+from functools import lru_cache
+from rapidfuzz.fuzz import partial_ratio
+from rapidfuzz.process import cdist
+from typing import List
+from botocore.config import Config
+
+# Initialize Kendra client; keepalive and pooled connections avoid a new TLS
+# handshake per query on warm containers
+kendra = boto3.client(
+    'kendra',
+    region_name='ap-southeast-2',
+    config=Config(
+        tcp_keepalive=True,
+        max_pool_connections=20,
+        retries={'mode': 'adaptive', 'max_attempts': 3},
+        connect_timeout=2,
+        read_timeout=10
+    )
+)
 kendra_name = "product-desc"
 
 
@@ -39,6 +56,32 @@ def get_index_id_by_name(client, index_name):
         return None
 
 
+# Seconds to wait before retrying a failed index lookup
+INDEX_LOOKUP_RETRY_SECONDS = 30
+
+kendra_index_id = None
+_index_lookup_lock = threading.Lock()
+_last_index_lookup = 0.0
+
+
+def get_kendra_index_id():
+    """
+    Return the cached Kendra index ID, looking it up again if a previous lookup failed.
+
+    Failed request-time lookups are retried at most once every INDEX_LOOKUP_RETRY_SECONDS.
+    """
+    global kendra_index_id, _last_index_lookup
+    if kendra_index_id:
+        return kendra_index_id
+    with _index_lookup_lock:
+        if not kendra_index_id and time.time() - _last_index_lookup >= INDEX_LOOKUP_RETRY_SECONDS:
+            _last_index_lookup = time.time()
+            kendra_index_id = get_index_id_by_name(kendra, kendra_name)
+    return kendra_index_id
+
+
+# Warm the cache at import; this attempt doesn't start the retry window, so the
+# first request after a failed cold-start lookup retries immediately
 kendra_index_id = get_index_id_by_name(kendra, kendra_name)
 
 
@@ -62,8 +105,8 @@ def create_contains_filter(key, value):
     }
 
 
-def create_gender_base_filter(gender=''):
-    """Create base gender filter."""
+def build_gender_base_filter(gender=''):
+    """Build base gender filter."""
     if not gender:
         return create_equals_filter('gender', 'male female')
 
@@ -75,33 +118,72 @@ def create_gender_base_filter(gender=''):
     }
 
 
+# Filters for the common gender values are built once; they are never mutated
+_GENDER_FILTERS = {
+    gender: build_gender_base_filter(gender)
+    for gender in ('', 'male', 'female', 'unisex')
+}
+
+
+def create_gender_base_filter(gender=''):
+    """Create base gender filter."""
+    gender_filter = _GENDER_FILTERS.get(gender or '')
+    if gender_filter is None:
+        return build_gender_base_filter(gender)
+    return gender_filter
+
+
+# Filter factory per filterable attribute key; other keys are not filtered on
+_ATTRIBUTE_FILTER_FACTORIES = {
+    "std_product_type": create_contains_filter,
+    "category": create_equals_filter,
+}
+
+
 def create_single_attribute_filter(key, value):
     """Create filter for a single attribute."""
     if not value:
         return None
 
-    if key == "std_product_type":
-        return create_contains_filter(key, value)
-    
-    if key == "category":
-        return create_equals_filter(key, value)
+    factory = _ATTRIBUTE_FILTER_FACTORIES.get(key)
+    if factory:
+        return factory(key, value)
 
     # return create_equals_filter(key, value)
     return None
 
 
+@lru_cache(maxsize=64)
+def compile_filter_builder(keys):
+    """
+    Compile a filter builder for one attribute schema.
+
+    Args:
+        keys (tuple): Attribute keys, in the order their filters should appear.
+
+    Returns:
+        Callable that builds the filters from an attributes dict with those keys.
+    """
+    # Keys without a filter factory are dropped once here instead of on every request
+    filterable_keys = [key for key in keys if key in _ATTRIBUTE_FILTER_FACTORIES]
+
+    def build_filters(extracted_attributes):
+        filters = []
+        for key in filterable_keys:
+            filter_item = create_single_attribute_filter(key, extracted_attributes[key])
+            if filter_item:
+                filters.append(filter_item)
+        return filters
+
+    return build_filters
+
+
 def create_dynamic_filters(extracted_attributes):
     """Create filters from extracted attributes."""
-    filters = []
     if not extracted_attributes:
-        return filters
+        return []
 
-    for key, value in extracted_attributes.items():
-        filter_item = create_single_attribute_filter(key, value)
-        if filter_item:
-            filters.append(filter_item)
-
-    return filters
+    return compile_filter_builder(tuple(extracted_attributes))(extracted_attributes)
 
 
 def combine_attribute_filters(gender_filter, dynamic_filters):
@@ -117,15 +199,18 @@ def combine_attribute_filters(gender_filter, dynamic_filters):
     }
 
 
+def create_facets(facets):
+    """Create Kendra facet requests for the given attribute keys."""
+    return [{'DocumentAttributeKey': facet, 'MaxResults': 10} for facet in facets]
+
+
+# Facets requested on every query unless the caller overrides them
+_DEFAULT_FACETS = create_facets(['category', 'brand'])
+
+
 def create_query_params(index_id, query_text, attribute_filter, top_n , facets = None):
-    facets_list = []
-    for facet in facets:
-        facets_list.append({
-            'DocumentAttributeKey': facet,
-            'MaxResults': 10
-        })
-    
     """Create parameters for Kendra query."""
+    facets_list = _DEFAULT_FACETS if facets is None else create_facets(facets)
     return {
         "IndexId": index_id,
         "QueryText": query_text,
@@ -137,21 +222,29 @@ def create_query_params(index_id, query_text, attribute_filter, top_n , facets =
     }
 
 
+# Kendra score confidences accepted as a match
+_ACCEPTED_CONFIDENCES = frozenset(("VERY_HIGH", "HIGH", "MEDIUM"))
+
+
 def process_single_result(item):
     """Process a single result item."""
-    try:
-        if item.get('DocumentId') and item.get("ScoreAttributes" , {}).get("ScoreConfidence" , "") in ["VERY_HIGH" , "HIGH", "MEDIUM"]:
-            print("Score Confidence",item.get("ScoreAttributes" , {}).get("ScoreConfidence" , ""))
-            return item.get('DocumentId')
-    except Exception as e:
-        logger.error(f"Error parsing content: {e}")
+    document_id = item.get('DocumentId')
+    if not document_id:
+        return None
+    score_attributes = item.get("ScoreAttributes")
+    confidence = score_attributes.get("ScoreConfidence") if score_attributes else None
+    if confidence in _ACCEPTED_CONFIDENCES:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Score Confidence: %s", confidence)
+        return document_id
     return None
 
 
 def extract_product_ids(results):
     """Extract product IDs from results."""
     product_ids = []
-    print("results" , len(results))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("results: %s", len(results))
     for item in results:
         product_id = process_single_result(item)
         if product_id:
@@ -177,11 +270,13 @@ def extract_product_details(kendra_res):
 
 
 def validate_index():
-    """Validate Kendra index existence."""
-    if not kendra_index_id:
+    """Validate Kendra index existence and return its ID."""
+    index_id = get_kendra_index_id()
+    if not index_id:
         raise Exception(
             f"Couldn't find the kendra_id for kendra name: {kendra_name}"
         )
+    return index_id
 
 
 def get_query_text(user_message, extracted_attributes):
@@ -194,48 +289,41 @@ def get_query_text(user_message, extracted_attributes):
 def get_doc_title(document):
     return document.get("DocumentTitle", {}).get("Text" , "")
 
-def get_doc_with_title(documents):
-    res_docs = []
-    for doc in documents:
-        product_id = doc.get("DocumentId" , "")
-        if(product_id):
-            doc_title = get_doc_title(doc)
-            res_docs.append({
-                "product_id":product_id,
-                "doc_title":doc_title
-            })
-    return res_docs
+# Sort key for (sequence, title) chunk tuples
+_sequence_key = itemgetter(0)
 
 
-def group_and_combine(products):
+def fuse_results(results):
     """
-    Groups products by their actual ID and combines their titles in order of the sequence number.
+    Groups Kendra result chunks by their actual product ID and combines their titles
+    in order of the sequence number, in a single pass over the results.
 
     Args:
-        products (list): List of dictionaries with "product_id" and "doc_title" keys.
+        results (list): Kendra ResultItems with "DocumentId" and "DocumentTitle" keys.
 
     Returns:
-        dict: A dictionary where the key is the actual ID and the value is the combined title.
+        dict: A dictionary where the key is the actual ID and the value is a
+            (combined title, lowercased combined title) tuple.
     """
     grouped_products = defaultdict(list)
 
-    # Split product_id and group by actual ID
-    for product in products:
-        if len(product["product_id"].split("__"))==1:
-            actual_id = product["product_id"].split("__")[0]
-            sequence = "0"
-        else:
-            actual_id, sequence = product["product_id"].split("__")
-        grouped_products[actual_id].append((int(sequence), product["doc_title"]))
+    # Split DocumentId ("<product_id>__<sequence>") and group by actual ID
+    for doc in results:
+        product_id = doc.get("DocumentId" , "")
+        if product_id:
+            actual_id, separator, sequence = product_id.partition("__")
+            grouped_products[actual_id].append((int(sequence) if separator else 0, get_doc_title(doc)))
 
     # Combine titles in order of sequence
     combined_results = {}
     for actual_id, items in grouped_products.items():
-        # Sort by sequence number
-        sorted_items = sorted(items, key=lambda x: x[0])
+        # Sort by sequence number, in place and only when there is more than one chunk
+        if len(items) > 1:
+            items.sort(key=_sequence_key)
         # Combine titles
-        combined_title = " ".join(title for _, title in sorted_items)
-        combined_results[actual_id] = combined_title
+        combined_title = " ".join(title for _, title in items)
+        # Lowercase once here so fuzzy matching doesn't redo it per query
+        combined_results[actual_id] = (combined_title, combined_title.lower())
 
     return combined_results
 
@@ -256,13 +344,13 @@ def retrieve_kendra(
         top_n: Number of results to return
 
     Returns:
-        List of product IDs
+        Dict of product ID to (combined title, lowercased title)
         kendra_query params
     """
     start_time = time.time()
 
     try:
-        validate_index()
+        index_id = validate_index()
 
         start_time = time.time()
         query_text = get_query_text(query_text, extracted_attributes)
@@ -279,11 +367,10 @@ def retrieve_kendra(
 
     
         kendra_params = create_query_params(
-            kendra_index_id,
+            index_id,
             query_text,
             attribute_filter,
-            top_n,
-            ['category', 'brand']
+            top_n
         )
 
         response = kendra.query(**kendra_params)
@@ -291,8 +378,7 @@ def retrieve_kendra(
         
         
         # fuzzywuzzy
-        doc_with_titles = get_doc_with_title(results)
-        grouped_titles = group_and_combine(doc_with_titles)
+        grouped_titles = fuse_results(results)
         
 #         product_ids = extract_product_ids(results)
         
@@ -310,107 +396,66 @@ def retrieve_kendra(
 
 
 
-def fuzzy_search(query: str, products: Dict, threshold: int = 20) -> List[Dict]:
+def fuzzy_score_matrix(queries: List[str], titles: List[str]) -> np.ndarray:
     """
-    Perform fuzzy search on a product database.
-    
+    Score every query against every product title in a single vectorized call.
+
     Args:
-        query (str): Search query.
-        products (List[Dict]): List of product dictionaries.
-        threshold (int): Minimum similarity score for a match.
-        
+        queries (List[str]): Search queries.
+        titles (List[str]): Lowercased product titles to match against.
+
     Returns:
-        List[Dict]: List of matched products with scores.
+        np.ndarray: A (len(queries), len(titles)) matrix of partial_ratio scores (0-100).
     """
-    results = []
-    for product_id , combined_title in products.items():
-        # Concatenate all product fields for comprehensive matching
-        combined_text = combined_title
-        similarity_score = partial_ratio(query.lower(), combined_text.lower())
-        # print("-----------------------------------------------")
-        # print("product_details:" , combined_title)
-        # print("similarity_score::" , similarity_score)
-        # print("-----------------------------------------------")
-        print("Fuzzy results::",query, ":", combined_text , similarity_score)
-        if similarity_score >= threshold:
-            results.append({"product_title": combined_title, "score": similarity_score, "product_id":product_id})
-    
-    # Sort results by similarity score in descending order
-    results.sort(key=lambda x: x["score"], reverse=True)
-    return results
-
-
-def weight_results(prod_type, prod_color, prod_occasion):
-    prod_type_weight = 3
-    prod_color_weight = 2
-    prod_occasion_weight = 1
-
-    # Calculate the weighted sum
-    prod = (prod_type_weight * prod_type) + (prod_color_weight * prod_color) + (prod_occasion_weight * prod_occasion)
-
-    # Determine the divisor based on nonzero parameters
-    total_weight = (
-        (prod_type_weight if prod_type else 0) +
-        (prod_color_weight if prod_color else 0) +
-        (prod_occasion_weight if prod_occasion else 0)
+    if not queries:
+        return np.zeros((0, len(titles)))
+    return cdist(
+        [query.lower() for query in queries],
+        titles,
+        scorer=partial_ratio,
+        dtype=np.float64,
+        # At most 3 x PageSize strings: a thread pool would cost more than it saves
+        workers=1
     )
 
-    # Normalize only if total_weight is nonzero
-    return prod / (total_weight * 100) if total_weight else 0
+
+# Relative importance of product type, color and occasion matches
+ATTRIBUTE_WEIGHTS = np.array([3, 2, 1], dtype=np.float64)
+ATTRIBUTE_KEYS = ("prod_type", "prod_color", "product_occasion")
 
 
-def match_products_partial(list1, list2, list3):
+def weight_score_matrix(scores: np.ndarray, weights: np.ndarray = ATTRIBUTE_WEIGHTS) -> np.ndarray:
     """
-    Matches product_id across three lists and returns a combined list of dictionaries.
-    Includes product_ids found in any of the lists, even if not common across all.
-    
+    Combine per-attribute scores into one weight per product.
+
     Args:
-        list1 (list): First list of dictionaries.
-        list2 (list): Second list of dictionaries.
-        list3 (list): Third list of dictionaries.
-    
+        scores (np.ndarray): A (K, N) matrix of fuzzy scores, one row per queried attribute.
+        weights (np.ndarray): The (K,) weights of those attributes.
+
     Returns:
-        list: A list of dictionaries in the specified format.
+        np.ndarray: An (N,) array of weighted scores normalized to 0-1.
     """
-    # Create dictionaries with product_id as the key for quick lookup
-    dict1 = {item["product_id"]: item for item in list1}
-    dict2 = {item["product_id"]: item for item in list2}
-    dict3 = {item["product_id"]: item for item in list3}
-
-    # Combine all product_ids from the three lists
-    all_product_ids = set(dict1.keys()) | set(dict2.keys()) | set(dict3.keys())
-
-    # Create the final result list
-    final_list = []
-    for product_id in all_product_ids:
-        final_list.append({
-            "prod_type": dict1.get(product_id, {}),
-            "prod_color": dict2.get(product_id, {}),
-            "product_occasion": dict3.get(product_id, {}),
-            "product_id": product_id
-        })
-    
-    return final_list
-
-
-def weight_list_of_product_results(product_results):
-    final_res = []
-    for pro_res in product_results:
-        product_id = pro_res.get("product_id")
-        res = weight_results(pro_res.get("prod_type").get("score", 0),
-                            pro_res.get("prod_color").get("score", 0),
-                            pro_res.get("product_occasion").get("score", 0)
-                            )
-        final_res.append({
-            "product_id":product_id,
-            "total_weight": res,
-            "overall_score":res*100,
-            "prod_type": pro_res.get("prod_type") if pro_res.get("prod_type") else False,
-            "prod_color":  pro_res.get("prod_color") if pro_res.get("prod_color") else False,
-            "product_occasion": pro_res.get("product_occasion") if pro_res.get("product_occasion") else False,
-            
-        })
-    return final_res
+    # Calculate the weighted sum
+    weighted_sum = weights @ scores
+
+    # Determine the divisor based on nonzero scores
+    total_weight = weights @ (scores > 0)
+
+    # Normalize only where total_weight is nonzero
+    return np.divide(weighted_sum, total_weight * 100,
+                     out=np.zeros_like(weighted_sum), where=total_weight > 0)
+
+
+def build_weighted_result(product_id, title, total_weight, attribute_scores):
+    """Build the result dict for one product; attributes that were not queried are False."""
+    result = {
+        "product_id": product_id,
+        "total_weight": total_weight,
+        "overall_score": total_weight * 100,
+    }
+    for key, score in zip(ATTRIBUTE_KEYS, attribute_scores):
+        result[key] = {"product_title": title, "score": score, "product_id": product_id} if score is not None else False
+    return result
 
 
 def product_search(user_message, product_attr, user_gender):
@@ -424,37 +469,45 @@ def product_search(user_message, product_attr, user_gender):
     kendra_res, kendra_params = retrieve_kendra( kendra_query, {}, user_gender, 20)
     grouped_titles = kendra_res
     
-#   fuzzy search
-    p_t_res, p_c_res, p_o_res = [], [], []
-    if product_type:
-        p_t_res = fuzzy_search(product_type , grouped_titles, 0) # o(m*n)
-    if product_color:
-        p_c_res = fuzzy_search(product_color, grouped_titles, 0)
-    if product_occasion:
-        p_o_res = fuzzy_search(product_occasion, grouped_titles, 0)
-    
-    
-    
-#   Matching product partially based on color, prod_type and occaasion
-    matched_prod_list = match_products_partial(p_t_res, p_c_res, p_o_res)
+#   fuzzy search: score all non-empty attributes against all titles at once
+    product_ids = list(grouped_titles.keys())
+    titles = [title for title, _ in grouped_titles.values()]
+    lower_titles = [lower_title for _, lower_title in grouped_titles.values()]
+    queries = [product_type, product_color, product_occasion]
+    # Only queried attributes are scored; without any, Kendra's ranking is kept as is
+    active = [index for index, query in enumerate(queries) if query]
+    scores = fuzzy_score_matrix([queries[index] for index in active], lower_titles)
+    if logger.isEnabledFor(logging.DEBUG):
+        for row, index in enumerate(active):
+            for title, score in zip(titles, scores[row].tolist()):
+                logger.debug("Fuzzy results:: %s : %s %s", queries[index], title, score)
     
 #   Adding variable weights to important fields
-    weighted_results = weight_list_of_product_results(matched_prod_list)
+    total_weights = weight_score_matrix(scores, ATTRIBUTE_WEIGHTS[active])
+
+# sorting the results
+    # Stable, so products with equal weights keep Kendra's order
+    order = np.argsort(-total_weights, kind="stable").tolist()
+
+    # One plain tuple per product; result dicts are only built for the products kept
+    score_rows = dict(zip(active, scores.tolist()))
+    unscored = [None] * len(titles)
+    rows = list(zip(
+        product_ids,
+        titles,
+        total_weights.tolist(),
+        *(score_rows.get(index, unscored) for index in range(len(queries)))
+    ))
 
-# sorting the results    
-    results = sorted(weighted_results, key=lambda x: x["total_weight"], reverse=True)
-    product_ids = [res["product_id"] for res in results]
-    
     final_results = []
     final_product_ids = []
-    for res in results:
-        if product_type:
-            if res.get("prod_type"):
-                final_results.append(res.copy())
-                final_product_ids.append(res["product_id"])
-        else:
-            final_results.append(res.copy())
-            final_product_ids.append(res["product_id"])
+    for i in order:
+        product_id, title, total_weight, *attribute_scores = rows[i]
+        # When a product type was asked for, keep only products scored on it
+        if product_type and attribute_scores[0] is None:
+            continue
+        final_results.append(build_weighted_result(product_id, title, total_weight, attribute_scores))
+        final_product_ids.append(product_id)
     print("######################## final_results from search", final_results)
     return final_product_ids, kendra_params, final_results
 